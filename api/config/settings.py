@@ -1,32 +1,41 @@
+import functools
 import os
+from dataclasses import dataclass, field
 from typing import Optional
 
+@functools.cache
+def ensure_directory(path: str) -> str:
+    """Create a directory if it doesn't exist, checking each path once per process"""
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+        print(f"✓ Created folder: {path}")
+    return path
+
+@dataclass(frozen=True, slots=True)
 class Settings:
     # Database Configuration
-    DATABASE_TYPE: str = os.getenv("DATABASE_TYPE", "sqlite")
-    DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./local_database.db")
-    
+    DATABASE_TYPE: str = field(default_factory=lambda: os.getenv("DATABASE_TYPE", "sqlite"))
+    DATABASE_URL: str = field(default_factory=lambda: os.getenv("DATABASE_URL", "sqlite:///./local_database.db"))
+
     # Application Settings
-    DEBUG: bool = os.getenv("DEBUG", "True").lower() == "true"
-    SECRET_KEY: str = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
-    SESSION_TIMEOUT_HOURS: int = int(os.getenv("SESSION_TIMEOUT_HOURS", "24"))
-    
+    DEBUG: bool = field(default_factory=lambda: os.getenv("DEBUG", "True").lower() == "true")
+    SECRET_KEY: str = field(default_factory=lambda: os.getenv("SECRET_KEY", "dev-secret-key-change-in-production"))
+    SESSION_TIMEOUT_HOURS: int = field(default_factory=lambda: int(os.getenv("SESSION_TIMEOUT_HOURS", "24")))
+
     # File Storage
-    UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "./uploads")
-    MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
-    
+    UPLOAD_FOLDER: str = field(default_factory=lambda: os.getenv("UPLOAD_FOLDER", "./uploads"))
+    MAX_FILE_SIZE: int = field(default_factory=lambda: int(os.getenv("MAX_FILE_SIZE", "10485760")))  # 10MB
+
     # API Keys (for later phases)
-    GEMINI_API_KEY: Optional[str] = os.getenv("GEMINI_API_KEY")
-    
-    @classmethod
-    def validate(cls):
-        """Validate required settings"""
-        if not cls.SECRET_KEY or cls.SECRET_KEY == "dev-secret-key-change-in-production":
+    GEMINI_API_KEY: Optional[str] = field(default_factory=lambda: os.getenv("GEMINI_API_KEY"))
+
+    @functools.lru_cache(maxsize=1)
+    def validate(self):
+        """Validate required settings, once per settings instance"""
+        if not self.SECRET_KEY or self.SECRET_KEY == "dev-secret-key-change-in-production":
             print("⚠️  Warning: Using default secret key. Change in production!")
-        
-        if not os.path.exists(cls.UPLOAD_FOLDER):
-            os.makedirs(cls.UPLOAD_FOLDER, exist_ok=True)
-            print(f"✓ Created upload folder: {cls.UPLOAD_FOLDER}")
+
+        ensure_directory(self.UPLOAD_FOLDER)
 
 # Global settings instance
-settings = Settings() 
\ No newline at end of file
+settings = Settings()
@@ -1,11 +1,36 @@
 import os
+import queue
 import sqlite3
+import sys
+import threading
 from contextlib import contextmanager
 from typing import Generator
 import logging
+from .migrations import ensure_schema
+
+# Pooled connections: one writer plus a handful of concurrent readers
+POOL_SIZE = 5
+
+# Seconds to wait for a free pooled connection before giving up
+POOL_TIMEOUT = 30
+
+# Memory-map up to 256MB of the database file; 32-bit hosts can't spare the address space
+MMAP_SIZE = 268435456 if sys.maxsize > 2**32 else 0
+
+# Applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA wal_autocheckpoint=1000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA foreign_keys=ON",
+]
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "./local_database.db"):
+    def __init__(self, db_path: str = "./local_database.db", pool_size: int = POOL_SIZE):
         # Support shared in-memory DB for tests
         if db_path == ":memory:shared":
             self.db_path = "file::memory:?cache=shared"
@@ -13,107 +38,94 @@ class DatabaseManager:
         else:
             self.db_path = db_path
             self.uri = False
-        if self.db_path not in [":memory:", "file::memory:?cache=shared"]:
-            self.setup_database()
+        self._pool = None
+        self._schema_ready = False
+        self._memory_conn = None
+        self._memory_lock = threading.RLock()
+        self._memory_depth = 0
+        self._write_lock = threading.Lock()
+        if self.is_in_memory:
+            # An in-memory database only lives as long as a connection to it, so keep one open
+            self._memory_conn = self._open_connection()
+        else:
+            self._pool = queue.Queue(maxsize=pool_size)
+            for _ in range(pool_size):
+                self._pool.put(self._open_connection())
+        # File-backed and in-memory managers alike are ready to use once constructed
+        ensure_schema(self)
+    
+    @property
+    def is_in_memory(self) -> bool:
+        return self.db_path in [":memory:", "file::memory:?cache=shared"]
+    
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a connection that can be handed between request threads"""
+        conn = sqlite3.connect(
+            self.db_path,
+            uri=getattr(self, 'uri', False),
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
     
     def setup_database(self):
         """Initialize database and create tables if they don't exist"""
-        with self.get_connection() as conn:
-            self.create_tables(conn)
+        ensure_schema(self)
     
     def setup_in_memory_database(self):
         """Setup tables for in-memory database (for testing)"""
-        # For in-memory databases, we need to create tables on each connection
-        # This method is a no-op for in-memory databases
-        pass
+        # The schema lives on the one persistent connection, so it is built once
+        ensure_schema(self)
     
     @contextmanager
     def get_connection(self) -> Generator[sqlite3.Connection, None, None]:
         """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path, uri=getattr(self, 'uri', False), detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-        conn.row_factory = sqlite3.Row  # Enable dict-like access
-        
-        # For in-memory databases, create tables on each connection
-        if self.db_path in [":memory:", "file::memory:?cache=shared"]:
-            self.create_tables(conn)
+        if self._memory_conn is not None:
+            # In-memory databases can't be pooled; callers take turns on the persistent connection
+            with self._memory_lock:
+                conn = self._memory_conn
+                self._memory_depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._memory_depth -= 1
+                    # Only the outermost borrower discards uncommitted work
+                    if self._memory_depth == 0 and conn.in_transaction:
+                        conn.rollback()
+            return
         
+        try:
+            conn = self._pool.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"No pooled database connection became free within {POOL_TIMEOUT}s"
+            ) from None
         try:
             yield conn
         finally:
-            conn.close()
+            # Discard uncommitted work so the next borrower starts clean
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
     
-    def create_tables(self, conn: sqlite3.Connection):
-        """Create all required database tables"""
-        tables = [
-            self._create_user_sessions_table(),
-            self._create_documents_table(),
-            self._create_user_inputs_table(),
-            self._create_tax_calculations_table(),
-            self._create_ai_conversations_table()
-        ]
-        
-        for table_sql in tables:
-            conn.execute(table_sql)
-        conn.commit()
-    
-    def _create_user_sessions_table(self) -> str:
-        return """
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            session_id TEXT PRIMARY KEY,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NOT NULL
-        )
-        """
-    
-    def _create_documents_table(self) -> str:
-        return """
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            file_url TEXT,
-            file_type TEXT NOT NULL,
-            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-        )
-        """
-    
-    def _create_user_inputs_table(self) -> str:
-        return """
-        CREATE TABLE IF NOT EXISTS user_inputs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            input_type TEXT NOT NULL,
-            field_name TEXT NOT NULL,
-            field_value TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-        )
-        """
-    
-    def _create_tax_calculations_table(self) -> str:
-        return """
-        CREATE TABLE IF NOT EXISTS tax_calculations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            gross_income REAL,
-            tax_old_regime REAL,
-            tax_new_regime REAL,
-            total_deductions REAL,
-            net_tax REAL,
-            calculation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-        )
-        """
+    @contextmanager
+    def get_write_connection(self) -> Generator[sqlite3.Connection, None, None]:
+        """Context manager for a connection holding the single writer slot"""
+        with self._write_lock:
+            with self.get_connection() as conn:
+                yield conn
     
-    def _create_ai_conversations_table(self) -> str:
-        return """
-        CREATE TABLE IF NOT EXISTS ai_conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            user_message TEXT NOT NULL,
-            ai_response TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-        )
-        """ 
\ No newline at end of file
+    def close(self):
+        """Close every pooled connection"""
+        if self._memory_conn is not None:
+            self._memory_conn.close()
+            self._memory_conn = None
+        if self._pool is None:
+            return
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -1,128 +1,256 @@
 import os
 import sqlite3
-from typing import List, Tuple
+from contextlib import contextmanager
+from typing import FrozenSet, Generator, List, Optional, Tuple
 from datetime import datetime
 
+# Table recording which migrations have been applied
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Every schema change, in order; built once at import
+_MIGRATIONS: List[Tuple[str, List[str]]] = [
+    ("000_schema_migrations", [
+        f"""CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            migration_name TEXT UNIQUE NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    ]),
+    ("001_initial_schema", [
+        """CREATE TABLE IF NOT EXISTS user_sessions (
+            session_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_url TEXT,
+            file_type TEXT NOT NULL,
+            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS user_inputs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            input_type TEXT NOT NULL,
+            field_name TEXT NOT NULL,
+            field_value TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS tax_calculations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            gross_income REAL,
+            tax_old_regime REAL,
+            tax_new_regime REAL,
+            total_deductions REAL,
+            net_tax REAL,
+            calculation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS ai_conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
+        )"""
+    ]),
+    ("002_add_employee_name_to_tax_calculations", [
+        "ALTER TABLE tax_calculations ADD COLUMN employee_name TEXT"
+    ]),
+    # SQLite can't alter a foreign key in place, so child tables are rebuilt
+    ("003_cascade_session_foreign_keys", [
+        """CREATE TABLE documents_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            file_url TEXT,
+            file_type TEXT NOT NULL,
+            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO documents_new (id, session_id, file_name, file_url, file_type, upload_timestamp)
+           SELECT id, session_id, file_name, file_url, file_type, upload_timestamp FROM documents""",
+        "DROP TABLE documents",
+        "ALTER TABLE documents_new RENAME TO documents",
+        """CREATE TABLE user_inputs_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            input_type TEXT NOT NULL,
+            field_name TEXT NOT NULL,
+            field_value TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO user_inputs_new (id, session_id, input_type, field_name, field_value, timestamp)
+           SELECT id, session_id, input_type, field_name, field_value, timestamp FROM user_inputs""",
+        "DROP TABLE user_inputs",
+        "ALTER TABLE user_inputs_new RENAME TO user_inputs",
+        """CREATE TABLE tax_calculations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            gross_income REAL,
+            tax_old_regime REAL,
+            tax_new_regime REAL,
+            total_deductions REAL,
+            net_tax REAL,
+            calculation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            employee_name TEXT,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO tax_calculations_new (id, session_id, gross_income, tax_old_regime, tax_new_regime,
+                                            total_deductions, net_tax, calculation_timestamp, employee_name)
+           SELECT id, session_id, gross_income, tax_old_regime, tax_new_regime,
+                  total_deductions, net_tax, calculation_timestamp, employee_name FROM tax_calculations""",
+        "DROP TABLE tax_calculations",
+        "ALTER TABLE tax_calculations_new RENAME TO tax_calculations",
+        """CREATE TABLE ai_conversations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            user_message TEXT NOT NULL,
+            ai_response TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (session_id) REFERENCES user_sessions(session_id) ON DELETE CASCADE
+        )""",
+        """INSERT INTO ai_conversations_new (id, session_id, user_message, ai_response, timestamp)
+           SELECT id, session_id, user_message, ai_response, timestamp FROM ai_conversations""",
+        "DROP TABLE ai_conversations",
+        "ALTER TABLE ai_conversations_new RENAME TO ai_conversations"
+    ]),
+    # Store expiry as a unix epoch so validation is an integer compare
+    ("004_expires_at_epoch", [
+        """CREATE TABLE user_sessions_new (
+            session_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at INTEGER NOT NULL
+        )""",
+        """INSERT INTO user_sessions_new (session_id, created_at, expires_at)
+           SELECT session_id, created_at,
+                  CASE typeof(expires_at)
+                      WHEN 'integer' THEN expires_at
+                      ELSE CAST(strftime('%s', expires_at, 'utc') AS INTEGER)
+                  END
+           FROM user_sessions""",
+        "DROP TABLE user_sessions",
+        "ALTER TABLE user_sessions_new RENAME TO user_sessions"
+    ]),
+    # Composite indexes give each table's rows for a session in timestamp order, and also serve
+    # plain session_id lookups. Per-table reads break timestamp ties on id, so the index carries
+    # id in the same direction and those reads (including LIMIT 1) need no sort. get_session_data
+    # still sorts its UNION ALL of all four tables, but only over one session's rows.
+    ("005_session_timestamp_indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_documents_sess_ts ON documents(session_id, upload_timestamp DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_user_inputs_sess_ts ON user_inputs(session_id, timestamp DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_tax_calculations_sess_ts ON tax_calculations(session_id, calculation_timestamp DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_ai_conversations_sess_ts ON ai_conversations(session_id, timestamp ASC, id ASC)"
+    ]),
+    # Lets the display page read a session's inputs already grouped by type
+    ("006_user_inputs_session_type_index", [
+        "CREATE INDEX IF NOT EXISTS idx_user_inputs_session_type ON user_inputs(session_id, input_type, field_name)"
+    ]),
+    # The upload's name on disk (the text after the last '/' of file_url), derived by SQLite on
+    # every insert and indexed so orphan checks and deletes can look files up by name
+    ("007_documents_stored_name", [
+        """ALTER TABLE documents ADD COLUMN stored_name TEXT GENERATED ALWAYS AS (
+            substr(file_url, length(rtrim(file_url, replace(file_url, '/', ''))) + 1)
+        ) VIRTUAL""",
+        "CREATE INDEX IF NOT EXISTS idx_documents_stored_name ON documents(stored_name)"
+    ])
+]
+
 class DatabaseMigration:
-    def __init__(self, db_path: str = "./local_database.db"):
+    def __init__(self, db_path: str = "./local_database.db", conn: Optional[sqlite3.Connection] = None,
+                 verbose: bool = True, db_manager=None):
         self.db_path = db_path
-        self.migrations_table = "schema_migrations"
-        self.setup_migrations_table()
+        # An already open connection (e.g. to an in-memory database) is used instead of db_path
+        self.conn = conn
+        # A DatabaseManager lets migrations run on its pooled writer connection
+        self.db_manager = db_manager
+        self.verbose = verbose
+        self.migrations_table = MIGRATIONS_TABLE
     
-    def setup_migrations_table(self):
-        """Create migrations tracking table"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS {self.migrations_table} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    migration_name TEXT UNIQUE NOT NULL,
-                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        if self.conn is not None:
+            yield self.conn
+        elif self.db_manager is not None:
+            with self.db_manager.get_write_connection() as conn:
+                yield conn
+        else:
+            with sqlite3.connect(self.db_path) as conn:
+                yield conn
+    
+    def _get_applied_migrations(self, conn: sqlite3.Connection) -> FrozenSet[str]:
+        # The tracking table itself is created by migration 000
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (self.migrations_table,)
+        ).fetchone()
+        if not exists:
+            return frozenset()
+        cursor = conn.execute(f"SELECT migration_name FROM {self.migrations_table}")
+        return frozenset(row[0] for row in cursor)
     
-    def get_applied_migrations(self) -> List[str]:
-        """Get list of applied migrations"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(f"SELECT migration_name FROM {self.migrations_table}")
-            return [row[0] for row in cursor.fetchall()]
+    def get_applied_migrations(self) -> FrozenSet[str]:
+        """Get the set of applied migrations"""
+        with self._connect() as conn:
+            return self._get_applied_migrations(conn)
+    
+    def _apply_migration(self, conn: sqlite3.Connection, migration_name: str, sql_commands: List[str]):
+        try:
+            # sqlite3 only opens a transaction implicitly before DML, so DDL would otherwise autocommit;
+            # an explicit BEGIN makes a migration and its schema_migrations row commit or roll back together
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for sql in sql_commands:
+                conn.execute(sql)
+            
+            conn.execute(
+                f"INSERT INTO {self.migrations_table} (migration_name) VALUES (?)",
+                (migration_name,)
+            )
+            conn.commit()
+            if self.verbose:
+                print(f"✓ Applied migration: {migration_name}")
+        except Exception as e:
+            conn.rollback()
+            print(f"✗ Failed to apply migration {migration_name}: {e}")
+            raise
     
     def apply_migration(self, migration_name: str, sql_commands: List[str]):
         """Apply a migration"""
-        with sqlite3.connect(self.db_path) as conn:
-            try:
-                for sql in sql_commands:
-                    conn.execute(sql)
-                
-                conn.execute(
-                    f"INSERT INTO {self.migrations_table} (migration_name) VALUES (?)",
-                    (migration_name,)
-                )
-                conn.commit()
-                print(f"✓ Applied migration: {migration_name}")
-            except Exception as e:
-                conn.rollback()
-                print(f"✗ Failed to apply migration {migration_name}: {e}")
-                raise
+        with self._connect() as conn:
+            self._apply_migration(conn, migration_name, sql_commands)
     
     def run_migrations(self):
         """Run all pending migrations"""
-        applied = self.get_applied_migrations()
-        
-        # Define migrations
-        migrations = [
-            ("001_initial_schema", [
-                """CREATE TABLE IF NOT EXISTS user_sessions (
-                    session_id TEXT PRIMARY KEY,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP NOT NULL
-                )""",
-                """CREATE TABLE IF NOT EXISTS documents (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    file_name TEXT NOT NULL,
-                    file_url TEXT,
-                    file_type TEXT NOT NULL,
-                    upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-                )""",
-                """CREATE TABLE IF NOT EXISTS user_inputs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    input_type TEXT NOT NULL,
-                    field_name TEXT NOT NULL,
-                    field_value TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-                )""",
-                """CREATE TABLE IF NOT EXISTS tax_calculations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    gross_income REAL,
-                    tax_old_regime REAL,
-                    tax_new_regime REAL,
-                    total_deductions REAL,
-                    net_tax REAL,
-                    calculation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-                )""",
-                """CREATE TABLE IF NOT EXISTS ai_conversations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    user_message TEXT NOT NULL,
-                    ai_response TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
-                )"""
-            ]),
-            ("002_add_employee_name_to_tax_calculations", [
-                "ALTER TABLE tax_calculations ADD COLUMN employee_name TEXT"
-            ])
-        ]
-        
-        for migration_name, sql_commands in migrations:
-            if migration_name not in applied:
-                self.apply_migration(migration_name, sql_commands)
-
-    def migration_add_employee_name_to_tax_calculations(self, conn):
-        conn.execute("""
-            ALTER TABLE tax_calculations ADD COLUMN employee_name TEXT
-        """)
-
-    def apply_migration(self, migration_name: str, sql_commands: List[str]):
-        """Apply a migration"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
+            applied = self._get_applied_migrations(conn)
+            pending = [(name, sql) for name, sql in _MIGRATIONS if name not in applied]
+            if not pending:
+                return
+            
+            # Table rebuilds drop and recreate tables, which must not fire cascading deletes
+            foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+            conn.execute("PRAGMA foreign_keys=OFF")
             try:
-                for sql in sql_commands:
-                    conn.execute(sql)
+                for migration_name, sql_commands in pending:
+                    self._apply_migration(conn, migration_name, sql_commands)
                 
-                conn.execute(
-                    f"INSERT INTO {self.migrations_table} (migration_name) VALUES (?)",
-                    (migration_name,)
-                )
-                conn.commit()
-                print(f"✓ Applied migration: {migration_name}")
-            except Exception as e:
-                conn.rollback()
-                print(f"✗ Failed to apply migration {migration_name}: {e}")
-                raise 
\ No newline at end of file
+                # Refresh planner statistics so new indexes get picked up
+                conn.execute("ANALYZE")
+            finally:
+                conn.execute(f"PRAGMA foreign_keys={'ON' if foreign_keys else 'OFF'}")
+
+def ensure_schema(db_manager) -> None:
+    """Create or upgrade a DatabaseManager's schema, once per manager"""
+    # A flag on the manager rather than a cache keyed on it, so closed managers can be freed
+    if db_manager._schema_ready:
+        return
+    DatabaseMigration(db_manager.db_path, db_manager=db_manager).run_migrations()
+    db_manager._schema_ready = True
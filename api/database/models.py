@@ -7,7 +7,7 @@ from decimal import Decimal
 class UserSession:
     session_id: str
     created_at: datetime
-    expires_at: datetime
+    expires_at: int  # unix epoch seconds
 
 @dataclass
 class Document:
@@ -1,162 +1,314 @@
-import uuid
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from typing import Optional, List, Dict, Any, Tuple, Generator
 from .connection import DatabaseManager
 from .models import UserSession, Document, UserInput, TaxCalculation, AIConversation
 
+# Session id generator, bound once to skip the attribute lookup per call
+_token_hex = secrets.token_hex
+
+# Maximum number of session expiry times kept in memory
+SESSION_CACHE_SIZE = 4096
+
+# Per-session tables returned by get_session_data: (columns, sort column, newest first)
+SESSION_DATA_TABLES = {
+    'documents': (
+        ['id', 'session_id', 'file_name', 'file_url', 'file_type', 'upload_timestamp'],
+        'upload_timestamp', True
+    ),
+    'user_inputs': (
+        ['id', 'session_id', 'input_type', 'field_name', 'field_value', 'timestamp'],
+        'timestamp', True
+    ),
+    'tax_calculations': (
+        ['id', 'session_id', 'gross_income', 'tax_old_regime', 'tax_new_regime',
+         'total_deductions', 'net_tax', 'calculation_timestamp', 'employee_name'],
+        'calculation_timestamp', True
+    ),
+    'ai_conversations': (
+        ['id', 'session_id', 'user_message', 'ai_response', 'timestamp'],
+        'timestamp', False
+    ),
+}
+
+def _build_session_data_sql() -> str:
+    """Build one UNION ALL query over every session table, tagged with the table name"""
+    width = max(len(columns) for columns, _, _ in SESSION_DATA_TABLES.values())
+    selects = []
+    for table, (columns, sort_column, _) in SESSION_DATA_TABLES.items():
+        padded = columns + ['NULL'] * (width - len(columns))
+        values = ', '.join(f"{column} AS c{i}" for i, column in enumerate(padded))
+        selects.append(
+            f"SELECT '{table}' AS kind, {values}, {sort_column} AS sort_ts FROM {table} WHERE session_id = ?"
+        )
+    ascending = ', '.join(
+        f"'{table}'" for table, (_, _, newest_first) in SESSION_DATA_TABLES.items() if not newest_first
+    )
+    return (
+        "SELECT * FROM (" + " UNION ALL ".join(selects) + ") "
+        # Same-timestamp rows are ordered by id (c0) in the table's own direction, as the per-table getters do
+        f"ORDER BY kind, CASE WHEN kind IN ({ascending}) THEN sort_ts END ASC, "
+        f"CASE WHEN kind IN ({ascending}) THEN c0 END ASC, sort_ts DESC, c0 DESC"
+    )
+
+SESSION_DATA_SQL = _build_session_data_sql()
+
 class DatabaseUtils:
+    # INSERT statements shared by the single-row and bulk save paths
+    INSERT_DOCUMENT_SQL = "INSERT INTO documents (session_id, file_name, file_url, file_type) VALUES (?, ?, ?, ?)"
+    INSERT_USER_INPUT_SQL = "INSERT INTO user_inputs (session_id, input_type, field_name, field_value) VALUES (?, ?, ?, ?)"
+    INSERT_TAX_CALCULATION_SQL = """INSERT INTO tax_calculations 
+                   (session_id, gross_income, tax_old_regime, tax_new_regime, total_deductions, net_tax, employee_name) 
+                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    INSERT_AI_CONVERSATION_SQL = "INSERT INTO ai_conversations (session_id, user_message, ai_response) VALUES (?, ?, ?)"
+    
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
+        # LRU of session_id -> expires_at epoch (0 for unknown ids); expiry never changes during a session's lifetime
+        self._expires_cache: "OrderedDict[str, int]" = OrderedDict()
+        self._expires_cache_lock = threading.Lock()
+    
+    @contextmanager
+    def _reader(self, conn: Optional[sqlite3.Connection]) -> Generator[sqlite3.Connection, None, None]:
+        """Use the caller's connection, or borrow one from the pool"""
+        if conn is not None:
+            yield conn
+            return
+        with self.db_manager.get_connection() as conn:
+            yield conn
     
-    def create_session(self, session_duration_hours: int = 24) -> str:
+    @contextmanager
+    def _writer(self, conn: Optional[sqlite3.Connection]) -> Generator[sqlite3.Connection, None, None]:
+        """Use the caller's connection and transaction, or a pooled writer committed on exit"""
+        if conn is not None:
+            yield conn
+            return
+        with self.db_manager.get_write_connection() as conn:
+            with conn:
+                yield conn
+    
+    def _cache_expires_at(self, session_id: str, expires_at: int):
+        with self._expires_cache_lock:
+            self._expires_cache[session_id] = expires_at
+            self._expires_cache.move_to_end(session_id)
+            if len(self._expires_cache) > SESSION_CACHE_SIZE:
+                self._expires_cache.popitem(last=False)
+    
+    def _fetch_expires_at(self, session_id: str, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Get a session's expiry time (0 if unknown), only querying the database on a cache miss"""
+        with self._expires_cache_lock:
+            expires_at = self._expires_cache.get(session_id)
+            if expires_at is not None:
+                self._expires_cache.move_to_end(session_id)
+                return expires_at
+        
+        with self._reader(conn) as conn:
+            result = conn.execute(
+                "SELECT expires_at FROM user_sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        
+        # Unknown ids are cached as already expired; create_session overwrites the entry
+        # if that id is ever issued, and ids are random so that never happens in practice
+        expires_at = result['expires_at'] if result else 0
+        self._cache_expires_at(session_id, expires_at)
+        return expires_at
+    
+    def create_session(self, session_duration_hours: int = 24, conn: Optional[sqlite3.Connection] = None) -> str:
         """Create a new user session"""
-        session_id = str(uuid.uuid4())
-        expires_at = datetime.now() + timedelta(hours=session_duration_hours)
+        session_id = _token_hex(16)
+        expires_at = int(time.time()) + session_duration_hours * 3600
         
-        with self.db_manager.get_connection() as conn:
+        with self._writer(conn) as conn:
             conn.execute(
                 "INSERT INTO user_sessions (session_id, expires_at) VALUES (?, ?)",
                 (session_id, expires_at)
             )
-            conn.commit()
         
+        self._cache_expires_at(session_id, expires_at)
         return session_id
     
-    def validate_session(self, session_id: str) -> bool:
+    def validate_session(self, session_id: str, conn: Optional[sqlite3.Connection] = None) -> bool:
         """Check if session exists and is not expired"""
-        with self.db_manager.get_connection() as conn:
-            cursor = conn.execute(
-                "SELECT expires_at FROM user_sessions WHERE session_id = ?",
-                (session_id,)
-            )
-            result = cursor.fetchone()
-            
-            if not result:
-                return False
-            expires_at_val = result['expires_at']
-            if isinstance(expires_at_val, datetime):
-                expires_at = expires_at_val
-            else:
-                expires_at_str = str(expires_at_val)
-                try:
-                    expires_at = datetime.fromisoformat(expires_at_str)
-                except Exception:
-                    try:
-                        expires_at = datetime.strptime(expires_at_str, "%Y-%m-%d %H:%M:%S.%f")
-                    except Exception:
-                        expires_at = datetime.strptime(expires_at_str, "%Y-%m-%d %H:%M:%S")
-            return datetime.now() < expires_at
-    
-    def cleanup_expired_sessions(self) -> int:
+        return time.time() < self._fetch_expires_at(session_id, conn)
+    
+    def delete_expired_sessions(self, conn: Optional[sqlite3.Connection] = None) -> List[str]:
+        """Remove expired sessions and related data, returning the removed session ids"""
+        with self._writer(conn) as conn:
+            # Related rows are removed by ON DELETE CASCADE in the same transaction
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            session_ids = [row[0] for row in conn.execute(
+                "DELETE FROM user_sessions WHERE expires_at < ? RETURNING session_id",
+                (int(time.time()),)
+            )]
+        
+        with self._expires_cache_lock:
+            self._expires_cache.clear()
+        return session_ids
+    
+    def cleanup_expired_sessions(self, conn: Optional[sqlite3.Connection] = None) -> int:
         """Remove expired sessions and related data"""
-        with self.db_manager.get_connection() as conn:
-            # Get expired session IDs
-            cursor = conn.execute(
-                "SELECT session_id FROM user_sessions WHERE expires_at < ?",
-                (datetime.now(),)
-            )
-            expired_sessions = [row['session_id'] for row in cursor.fetchall()]
-            
-            if not expired_sessions:
-                return 0
-            
-            # Delete related data
-            placeholders = ','.join(['?' for _ in expired_sessions])
-            conn.execute(f"DELETE FROM documents WHERE session_id IN ({placeholders})", expired_sessions)
-            conn.execute(f"DELETE FROM user_inputs WHERE session_id IN ({placeholders})", expired_sessions)
-            conn.execute(f"DELETE FROM tax_calculations WHERE session_id IN ({placeholders})", expired_sessions)
-            conn.execute(f"DELETE FROM ai_conversations WHERE session_id IN ({placeholders})", expired_sessions)
-            conn.execute(f"DELETE FROM user_sessions WHERE session_id IN ({placeholders})", expired_sessions)
-            
-            conn.commit()
-            return len(expired_sessions)
+        return len(self.delete_expired_sessions(conn))
     
-    def get_session_data(self, session_id: str) -> Dict[str, Any]:
+    def get_session_data(self, session_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
         """Get all data associated with a session"""
-        if not self.validate_session(session_id):
+        if not self.validate_session(session_id, conn):
             return {}
         
-        with self.db_manager.get_connection() as conn:
-            # Get documents
-            documents = conn.execute(
-                "SELECT * FROM documents WHERE session_id = ? ORDER BY upload_timestamp DESC",
-                (session_id,)
-            ).fetchall()
-            
-            # Get user inputs
-            user_inputs = conn.execute(
-                "SELECT * FROM user_inputs WHERE session_id = ? ORDER BY timestamp DESC",
-                (session_id,)
-            ).fetchall()
-            
-            # Get tax calculations
-            tax_calculations = conn.execute(
-                "SELECT * FROM tax_calculations WHERE session_id = ? ORDER BY calculation_timestamp DESC",
-                (session_id,)
-            ).fetchall()
-            
-            # Get AI conversations
-            ai_conversations = conn.execute(
-                "SELECT * FROM ai_conversations WHERE session_id = ? ORDER BY timestamp ASC",
-                (session_id,)
-            ).fetchall()
-            
+        # One round-trip for all four tables; rows come back grouped by table
+        with self._reader(conn) as conn:
+            rows = conn.execute(SESSION_DATA_SQL, (session_id,) * len(SESSION_DATA_TABLES)).fetchall()
+        
+        session_data = {table: [] for table in SESSION_DATA_TABLES}
+        for row in rows:
+            table = row['kind']
+            columns = SESSION_DATA_TABLES[table][0]
+            session_data[table].append(dict(zip(columns, tuple(row)[1:])))
+        return session_data
+    
+    def _get_session_rows(self, table: str, session_id: str, limit: Optional[int] = None,
+                          conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Get one table's rows for a session in SESSION_DATA_TABLES order, newest id breaking ties"""
+        columns, sort_column, newest_first = SESSION_DATA_TABLES[table]
+        direction = "DESC" if newest_first else "ASC"
+        # SQLite treats a negative LIMIT as no limit
+        with self._reader(conn) as conn:
+            cursor = conn.execute(
+                f"""SELECT {', '.join(columns)} FROM {table} WHERE session_id = ?
+                    ORDER BY {sort_column} {direction}, id {direction} LIMIT ?""",
+                (session_id, -1 if limit is None else limit)
+            )
+            return [dict(row) for row in cursor]
+    
+    def get_documents(self, session_id: str, limit: Optional[int] = None,
+                      conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Get a session's documents, newest first"""
+        return self._get_session_rows('documents', session_id, limit, conn)
+    
+    def get_user_inputs(self, session_id: str, limit: Optional[int] = None,
+                        conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Get a session's user inputs, newest first"""
+        return self._get_session_rows('user_inputs', session_id, limit, conn)
+    
+    def get_tax_calculations(self, session_id: str, limit: Optional[int] = None,
+                             conn: Optional[sqlite3.Connection] = None) -> List[Dict[str, Any]]:
+        """Get a session's tax calculations, newest first"""
+        return self._get_session_rows('tax_calculations', session_id, limit, conn)
+    
+    def get_session_bundle(self, session_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """Get what the display page needs: the latest document and tax calculation, and grouped inputs"""
+        with self._reader(conn) as conn:
+            documents = self.get_documents(session_id, limit=1, conn=conn)
+            if not documents:
+                return {'document': None, 'tax_calculation': {}, 'user_inputs': {}}
+            tax_calculations = self.get_tax_calculations(session_id, limit=1, conn=conn)
             return {
-                'documents': [dict(doc) for doc in documents],
-                'user_inputs': [dict(input_data) for input_data in user_inputs],
-                'tax_calculations': [dict(calc) for calc in tax_calculations],
-                'ai_conversations': [dict(conv) for conv in ai_conversations]
+                'document': documents[0],
+                'tax_calculation': tax_calculations[0] if tax_calculations else {},
+                'user_inputs': self.get_user_inputs_grouped(session_id, conn)
             }
     
-    def save_document(self, session_id: str, file_name: str, file_url: str, file_type: str) -> int:
+    def get_user_inputs_grouped(self, session_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Dict[str, str]]:
+        """Get a session's inputs as {input_type: {field_name: field_value}}, newest value winning"""
+        # Ordered by idx_user_inputs_session_type, whose trailing rowid puts the newest row last
+        with self._reader(conn) as conn:
+            rows = conn.execute(
+                """SELECT input_type, field_name, field_value FROM user_inputs
+                   WHERE session_id = ? ORDER BY input_type, field_name, id""",
+                (session_id,)
+            ).fetchall()
+        return {
+            input_type: {row['field_name']: row['field_value'] for row in group}
+            for input_type, group in groupby(rows, key=itemgetter('input_type'))
+        }
+    
+    def save_document(self, session_id: str, file_name: str, file_url: str, file_type: str,
+                      conn: Optional[sqlite3.Connection] = None) -> int:
         """Save document metadata to database"""
-        with self.db_manager.get_connection() as conn:
+        with self._writer(conn) as conn:
             cursor = conn.execute(
-                "INSERT INTO documents (session_id, file_name, file_url, file_type) VALUES (?, ?, ?, ?)",
+                self.INSERT_DOCUMENT_SQL,
                 (session_id, file_name, file_url, file_type)
             )
-            conn.commit()
             return cursor.lastrowid or 0
     
-    def save_user_input(self, session_id: str, input_type: str, field_name: str, field_value: str) -> int:
+    def save_user_input(self, session_id: str, input_type: str, field_name: str, field_value: str,
+                        conn: Optional[sqlite3.Connection] = None) -> int:
         """Save user input data to database"""
-        with self.db_manager.get_connection() as conn:
+        with self._writer(conn) as conn:
             cursor = conn.execute(
-                "INSERT INTO user_inputs (session_id, input_type, field_name, field_value) VALUES (?, ?, ?, ?)",
+                self.INSERT_USER_INPUT_SQL,
                 (session_id, input_type, field_name, field_value)
             )
-            conn.commit()
             return cursor.lastrowid or 0
     
     def save_tax_calculation(self, session_id: str, gross_income: float, tax_old_regime: float, 
-                           tax_new_regime: float, total_deductions: float, net_tax: float, employee_name: str = "") -> int:
+                           tax_new_regime: float, total_deductions: float, net_tax: float, employee_name: str = "",
+                           conn: Optional[sqlite3.Connection] = None) -> int:
         """Save tax calculation results to database"""
-        with self.db_manager.get_connection() as conn:
+        with self._writer(conn) as conn:
             cursor = conn.execute(
-                """INSERT INTO tax_calculations 
-                   (session_id, gross_income, tax_old_regime, tax_new_regime, total_deductions, net_tax, employee_name) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                self.INSERT_TAX_CALCULATION_SQL,
                 (session_id, gross_income, tax_old_regime, tax_new_regime, total_deductions, net_tax, employee_name)
             )
-            conn.commit()
             return cursor.lastrowid or 0
     
+    def session_owns_file(self, session_id: str, stored_name: str,
+                          conn: Optional[sqlite3.Connection] = None) -> bool:
+        """Check that a stored upload belongs to the session"""
+        with self._reader(conn) as conn:
+            return conn.execute(
+                "SELECT 1 FROM documents WHERE stored_name = ? AND session_id = ?",
+                (stored_name, session_id)
+            ).fetchone() is not None
+    
+    def delete_document(self, document_id: int, session_id: str,
+                        conn: Optional[sqlite3.Connection] = None) -> Optional[str]:
+        """Delete a session's document, returning its stored file name, or None if there was no such document"""
+        with self._writer(conn) as conn:
+            row = conn.execute(
+                "DELETE FROM documents WHERE id = ? AND session_id = ? RETURNING stored_name",
+                (document_id, session_id)
+            ).fetchone()
+            return row['stored_name'] if row else None
+    
     def save_ai_conversation(self, session_id: str, user_message: str, ai_response: str) -> int:
         """Save AI conversation to database"""
-        with self.db_manager.get_connection() as conn:
+        with self.db_manager.get_write_connection() as conn:
             cursor = conn.execute(
-                "INSERT INTO ai_conversations (session_id, user_message, ai_response) VALUES (?, ?, ?)",
+                self.INSERT_AI_CONVERSATION_SQL,
                 (session_id, user_message, ai_response)
             )
             conn.commit()
             return cursor.lastrowid or 0
     
-    def save_extracted_meta(self, session_id: str, meta: dict):
+    def save_documents_bulk(self, session_id: str, rows: List[Tuple[str, str, str]],
+                            conn: Optional[sqlite3.Connection] = None):
+        """Save many (file_name, file_url, file_type) documents for a session in one transaction"""
+        with self._writer(conn) as conn:
+            conn.executemany(
+                self.INSERT_DOCUMENT_SQL,
+                ((session_id, file_name, file_url, file_type) for file_name, file_url, file_type in rows)
+            )
+    
+    def save_user_inputs_bulk(self, rows: List[Tuple[str, str, str, str]], conn: Optional[sqlite3.Connection] = None):
+        """Save many (session_id, input_type, field_name, field_value) rows in one transaction"""
+        with self._writer(conn) as conn:
+            conn.executemany(self.INSERT_USER_INPUT_SQL, rows)
+    
+    def save_ai_conversations_bulk(self, rows: List[Tuple[str, str, str]]):
+        """Save many (session_id, user_message, ai_response) rows in one transaction"""
+        with self.db_manager.get_write_connection() as conn:
+            with conn:
+                conn.executemany(self.INSERT_AI_CONVERSATION_SQL, rows)
+    
+    def save_extracted_meta(self, session_id: str, meta: dict, conn: Optional[sqlite3.Connection] = None):
         """Save meta fields like net_salary, gross_salary, reimbursement to user_inputs"""
-        with self.db_manager.get_connection() as conn:
-            for key, value in meta.items():
-                conn.execute(
-                    "INSERT INTO user_inputs (session_id, input_type, field_name, field_value) VALUES (?, ?, ?, ?)",
-                    (session_id, 'meta', key, str(value))
-                )
-            conn.commit() 
\ No newline at end of file
+        self.save_user_inputs_bulk([(session_id, 'meta', key, str(value)) for key, value in meta.items()], conn) 
\ No newline at end of file
@@ -1,24 +1,65 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
+import aiofiles
+import asyncio
+import hashlib
+import multiprocessing
 import os
-import uuid
-from datetime import datetime
+import secrets
+import time
+import sqlite3
 from api.database.connection import DatabaseManager
-from api.database.migrations import DatabaseMigration
 from api.database.utils import DatabaseUtils
-from api.config.settings import settings
-from typing import Dict, Any
-from api.utils import extract_salary_slip_data
+from api.config.settings import settings, ensure_directory
+from typing import Dict, Any, Optional, Tuple
+from api.utils import extract_and_summarize
+
+# Worker processes for PDF extraction, alive for the app's lifespan
+extraction_pool: Optional[ProcessPoolExecutor] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database on startup"""
+    print("🚀 Starting Tax Advisor API...")
+    
+    # Create or upgrade the schema once, before the first request
+    db_manager.setup_database()
+    print("✓ Database migrations completed")
+    
+    # Validate settings
+    settings.validate()
+    print("✓ Configuration validated")
+    
+    global extraction_pool
+    # Forking this process would copy its threads' locks and its open SQLite connections into the
+    # workers, so they start from a clean server process instead (spawn where forkserver isn't available)
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    pool = extraction_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context(start_method)
+    )
+    
+    yield
+    
+    pool.shutdown(cancel_futures=True)
+    if extraction_pool is pool:
+        extraction_pool = None
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Tax Advisor API",
     description="AI-powered tax calculation and advisory system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -39,34 +80,91 @@ templates = Jinja2Templates(directory="templates")
 # Initialize database
 db_manager = DatabaseManager()
 db_utils = DatabaseUtils(db_manager)
-migration = DatabaseMigration()
 
 # Ensure upload directory exists
-os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
+ensure_directory(settings.UPLOAD_FOLDER)
 
-def convert_datetime_to_string(obj: Any) -> Any:
-    """Convert datetime objects to ISO format strings for JSON serialization"""
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    elif isinstance(obj, dict):
-        return {key: convert_datetime_to_string(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_datetime_to_string(item) for item in obj]
-    else:
-        return obj
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
-    print("🚀 Starting Tax Advisor API...")
+# Random upload filenames, bound once to skip the attribute lookup per request
+_token_urlsafe = secrets.token_urlsafe
+
+# Cookie carrying the session id, checked before uploaded files are served
+SESSION_COOKIE = "session_id"
+
+# Display page context per session, dropped whenever the session's documents change
+DISPLAY_CACHE_SIZE = 1024
+DISPLAY_CACHE_TTL = 300
+_display_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# Bumped by every invalidation, so a context built while rows changed isn't cached
+_display_version = 0
+
+def get_cached_display(session_id: str) -> Optional[Dict[str, Any]]:
+    """Return the cached display context for a session, if it hasn't expired"""
+    entry = _display_cache.get(session_id)
+    if entry is None:
+        return None
+    if time.monotonic() >= entry[0]:
+        del _display_cache[session_id]
+        return None
+    _display_cache.move_to_end(session_id)
+    return entry[1]
+
+def cache_display(session_id: str, context: Dict[str, Any], version: int):
+    """Remember a session's display context for DISPLAY_CACHE_TTL seconds, unless it went stale while being built"""
+    if version != _display_version:
+        return
+    _display_cache[session_id] = (time.monotonic() + DISPLAY_CACHE_TTL, context)
+    _display_cache.move_to_end(session_id)
+    if len(_display_cache) > DISPLAY_CACHE_SIZE:
+        _display_cache.popitem(last=False)
+
+def invalidate_display(session_id: str):
+    """Forget a session's display context after an upload or delete"""
+    global _display_version
+    _display_version += 1
+    _display_cache.pop(session_id, None)
+
+class UploadSessionMiddleware:
+    """Only serve /uploads files to the valid session that uploaded them, before StaticFiles runs"""
     
-    # Run database migrations
-    migration.run_migrations()
-    print("✓ Database migrations completed")
+    def __init__(self, app):
+        self.app = app
     
-    # Validate settings
-    settings.validate()
-    print("✓ Configuration validated")
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/uploads/"):
+            session_id = Request(scope).cookies.get(SESSION_COOKIE)
+            # The lookups are blocking SQLite calls, so they run off the event loop
+            if not session_id or not await run_in_threadpool(db_utils.validate_session, session_id):
+                response = ORJSONResponse({"detail": "Invalid or expired session"}, status_code=401)
+                await response(scope, receive, send)
+                return
+            stored_name = scope["path"][len("/uploads/"):]
+            if not await run_in_threadpool(db_utils.session_owns_file, session_id, stored_name):
+                response = ORJSONResponse({"detail": "File not found"}, status_code=404)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+async def write_upload(file_path: str, content: bytearray):
+    """Persist an upload's bytes without blocking the event loop"""
+    async with aiofiles.open(file_path, "wb") as buffer:
+        await buffer.write(content)
+
+def set_session_cookie(response: Response, session_id: str):
+    """Remember the session in a cookie so the browser can fetch its uploaded files"""
+    response.set_cookie(
+        SESSION_COOKIE,
+        session_id,
+        max_age=settings.SESSION_TIMEOUT_HOURS * 3600,
+        httponly=True,
+        samesite="lax"
+    )
+
+# Serve uploaded files straight from disk, gated on the session cookie
+app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_FOLDER), name="uploads")
+app.add_middleware(UploadSessionMiddleware)
 
 @app.get("/", response_class=HTMLResponse)
 async def upload_page(request: Request):
@@ -88,24 +186,25 @@ async def upload_pdf(
     if file.size and file.size > settings.MAX_FILE_SIZE:
         raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
     
-    # Generate session ID if not provided
-    if not session_id:
-        session_id = db_utils.create_session()
-    
-    # Validate session
-    if not db_utils.validate_session(session_id):
+    # Validate session, if one was provided
+    if session_id and not await run_in_threadpool(db_utils.validate_session, session_id):
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
     # Generate unique filename
     file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
+    unique_filename = f"{_token_urlsafe(16)}{file_extension}"
     file_path = os.path.join(settings.UPLOAD_FOLDER, unique_filename)
     
     try:
-        # Save file to disk
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Read the upload in chunks, enforcing the size limit as they arrive.
+        # Chunks are appended to one buffer, so the upload is never held twice.
+        file_hash = hashlib.sha256()
+        content = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if len(content) + len(chunk) > settings.MAX_FILE_SIZE:
+                raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
+            file_hash.update(chunk)
+            content += chunk
         
         # Determine file type based on filename
         file_type = "pay_slip"  # Default
@@ -115,55 +214,75 @@ async def upload_pdf(
         elif "salary" in filename_lower:
             file_type = "salary_slip"
         
-        # Save file metadata to database
-        doc_id = db_utils.save_document(
-            session_id=session_id,
-            file_name=file.filename,
-            file_url=f"/uploads/{unique_filename}",
-            file_type=file_type
-        )
-        
-        # --- PDF Extraction and Data Storage ---
-        extracted = extract_salary_slip_data(file_path)
-        # Store extracted fields in user_inputs
-        for field, value in extracted.get('employee', {}).items():
-            db_utils.save_user_input(session_id, 'employee', field, str(value))
-        for field, value in extracted.get('earnings', {}).items():
-            db_utils.save_user_input(session_id, 'earnings', field, str(value))
-        for field, value in extracted.get('deductions', {}).items():
-            db_utils.save_user_input(session_id, 'deductions', field, str(value))
-        # Save meta fields
-        meta_fields = {}
-        for key in ['net_salary', 'gross_salary', 'reimbursement']:
-            if extracted.get(key) is not None:
-                meta_fields[key] = extracted[key]
-        if meta_fields:
-            db_utils.save_extracted_meta(session_id, meta_fields)
+        # --- PDF Extraction ---
+        # Parsing is CPU-bound, so it runs in a worker process (or a thread outside the lifespan).
+        # It works from the bytes in memory while the copy served at file_url is written to disk.
+        write_task = asyncio.ensure_future(write_upload(file_path, content))
+        try:
+            loop = asyncio.get_running_loop()
+            extracted, gross, deductions_total = await loop.run_in_executor(extraction_pool, extract_and_summarize, content)
+        finally:
+            await write_task
         # --- Tax Calculation ---
-        gross = extracted.get('gross_salary') or 0
-        deductions_total = sum(extracted.get('deductions', {}).values())
         # Old Regime: gross - deductions
         tax_old = max(gross - deductions_total, 0) * 0.2  # Example: 20% tax
         # New Regime: flat 15% on gross
         tax_new = gross * 0.15
         net_tax = min(tax_old, tax_new)
         employee_name = extracted.get('employee', {}).get('name', '')
-        calc_id = db_utils.save_tax_calculation(
-            session_id=session_id,
-            gross_income=gross,
-            tax_old_regime=tax_old,
-            tax_new_regime=tax_new,
-            total_deductions=deductions_total,
-            net_tax=net_tax,
-            employee_name=employee_name
-        )
-        return JSONResponse({
+        
+        # --- Data Storage, in one write transaction once extraction is done ---
+        # The connection is only taken here, so slow uploads and extractions don't hold the pool
+        def store_upload() -> Tuple[str, int]:
+            with db_manager.get_write_connection() as conn:
+                with conn:
+                    # Generate session ID if not provided
+                    upload_session_id = session_id or db_utils.create_session(conn=conn)
+                    
+                    # Save file metadata to database
+                    doc_id = db_utils.save_document(
+                        session_id=upload_session_id,
+                        file_name=file.filename,
+                        file_url=f"/uploads/{unique_filename}",
+                        file_type=file_type,
+                        conn=conn
+                    )
+                    # Store extracted fields in user_inputs with one executemany
+                    db_utils.save_user_inputs_bulk([
+                        (upload_session_id, input_type, field, str(value))
+                        for input_type in ('employee', 'earnings', 'deductions')
+                        for field, value in extracted.get(input_type, {}).items()
+                    ], conn=conn)
+                    # Save meta fields
+                    meta_fields = {}
+                    for key in ['net_salary', 'gross_salary', 'reimbursement']:
+                        if extracted.get(key) is not None:
+                            meta_fields[key] = extracted[key]
+                    if meta_fields:
+                        db_utils.save_extracted_meta(upload_session_id, meta_fields, conn=conn)
+                    db_utils.save_tax_calculation(
+                        session_id=upload_session_id,
+                        gross_income=gross,
+                        tax_old_regime=tax_old,
+                        tax_new_regime=tax_new,
+                        total_deductions=deductions_total,
+                        net_tax=net_tax,
+                        employee_name=employee_name,
+                        conn=conn
+                    )
+                    return upload_session_id, doc_id
+        
+        session_id, doc_id = await run_in_threadpool(store_upload)
+        invalidate_display(session_id)
+        
+        response = ORJSONResponse({
             "success": True,
             "session_id": session_id,
             "document_id": doc_id,
             "file_name": file.filename,
             "file_type": file_type,
             "file_url": f"/uploads/{unique_filename}",
+            "sha256": file_hash.hexdigest(),
             "extracted": extracted,
             "tax": {
                 "old_regime": tax_old,
@@ -171,57 +290,36 @@ async def upload_pdf(
                 "net_tax": net_tax
             }
         })
+        set_session_cookie(response, session_id)
+        return response
         
     except Exception as e:
-        # Clean up file if database save fails
-        if os.path.exists(file_path):
+        # Clean up file if database save fails; the write transaction has already rolled back
+        try:
             os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@app.get("/uploads/{filename}")
-async def serve_file(filename: str):
-    """Serve uploaded files"""
-    file_path = os.path.join(settings.UPLOAD_FOLDER, filename)
-    
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    return FileResponse(file_path, media_type="application/pdf")
-
-@app.get("/display/{session_id}")
-async def display_pdf(request: Request, session_id: str):
-    """Display uploaded PDF with input forms and extracted data"""
-    # Validate session
-    if not db_utils.validate_session(session_id):
-        raise HTTPException(status_code=401, detail="Invalid or expired session")
-    # Get session data
-    session_data = db_utils.get_session_data(session_id)
-    documents = session_data.get('documents', [])
-    user_inputs = session_data.get('user_inputs', [])
-    tax_calculations = session_data.get('tax_calculations', [])
-    if not documents:
+def build_display_context(session_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+    """Assemble the display page's document, extracted fields, tax and best regime"""
+    # Get the most recent document and tax calculation, and inputs grouped by type in SQL
+    bundle = db_utils.get_session_bundle(session_id, conn)
+    latest_doc = bundle['document']
+    if not latest_doc:
         raise HTTPException(status_code=404, detail="No documents found for session")
-    # Get the most recent document
-    latest_doc = documents[0]
-    # Convert datetime objects to strings for JSON serialization
-    document_data = convert_datetime_to_string(latest_doc)
-    tax = tax_calculations[0] if tax_calculations else {}
+    tax = bundle['tax_calculation']
     # Organize extracted data for display
-    extracted = {'employee': {}, 'earnings': {}, 'deductions': {}}
-    for row in user_inputs:
-        if row['input_type'] == 'employee':
-            extracted['employee'][row['field_name']] = row['field_value']
-        elif row['input_type'] == 'earnings':
-            extracted['earnings'][row['field_name']] = row['field_value']
-        elif row['input_type'] == 'deductions':
-            extracted['deductions'][row['field_name']] = row['field_value']
+    user_inputs = bundle['user_inputs']
+    extracted = {input_type: user_inputs.get(input_type, {}) for input_type in ('employee', 'earnings', 'deductions')}
     # Add meta fields if present in user_inputs
-    for row in user_inputs:
-        if row['input_type'] == 'meta':
-            try:
-                extracted[row['field_name']] = float(row['field_value'])
-            except Exception:
-                extracted[row['field_name']] = row['field_value']
+    for field_name, field_value in user_inputs.get('meta', {}).items():
+        try:
+            extracted[field_name] = float(field_value)
+        except Exception:
+            extracted[field_name] = field_value
     # Fallback: get from tax_calculations if not found
     if 'gross_salary' not in extracted and tax and not isinstance(extracted.get('gross_salary'), dict):
         extracted['gross_salary'] = float(tax.get('gross_income', 0.0) or 0.0)
@@ -243,50 +341,53 @@ async def display_pdf(request: Request, session_id: str):
                 best_regime = 'Both are equal'
         except Exception:
             best_regime = None
-    return templates.TemplateResponse("display.html", {
-        "request": request,
+    return {
         "session_id": session_id,
-        "document": document_data,
+        "document": latest_doc,
         "extracted": extracted,
         "tax": tax,
         "best_regime": best_regime
-    })
+    }
+
+@app.get("/display/{session_id}")
+async def display_pdf(request: Request, session_id: str):
+    """Display uploaded PDF with input forms and extracted data"""
+    # Validate session
+    if not await run_in_threadpool(db_utils.validate_session, session_id):
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+    # The cache is only touched on the event loop; the database only on a miss, in the threadpool
+    context = get_cached_display(session_id)
+    if context is None:
+        version = _display_version
+        context = await run_in_threadpool(build_display_context, session_id)
+        cache_display(session_id, context, version)
+    response = templates.TemplateResponse("display.html", {"request": request, **context})
+    set_session_cookie(response, session_id)
+    return response
 
 @app.delete("/delete-file/{document_id}")
 async def delete_file(document_id: int, session_id: str):
     """Delete uploaded file"""
     
     # Validate session
-    if not db_utils.validate_session(session_id):
+    if not await run_in_threadpool(db_utils.validate_session, session_id):
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
-    # Get document info from database
-    with db_manager.get_connection() as conn:
-        cursor = conn.execute(
-            "SELECT file_url FROM documents WHERE id = ? AND session_id = ?",
-            (document_id, session_id)
-        )
-        result = cursor.fetchone()
-        
-        if not result:
-            raise HTTPException(status_code=404, detail="Document not found")
-        
-        file_url = result['file_url']
-        filename = file_url.split('/')[-1]
-        file_path = os.path.join(settings.UPLOAD_FOLDER, filename)
-        
-        # Delete from database
-        conn.execute(
-            "DELETE FROM documents WHERE id = ? AND session_id = ?",
-            (document_id, session_id)
-        )
-        conn.commit()
-        
-        # Delete file from disk
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        return JSONResponse({"success": True, "message": "File deleted successfully"})
+    # Delete from database through the single writer, learning the file name in the same statement
+    stored_name = await run_in_threadpool(db_utils.delete_document, document_id, session_id)
+    if stored_name is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    invalidate_display(session_id)
+    
+    file_path = os.path.join(settings.UPLOAD_FOLDER, stored_name)
+    
+    # Delete file from disk
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    
+    return ORJSONResponse({"success": True, "message": "File deleted successfully"})
 
 @app.get("/health")
 async def health_check():
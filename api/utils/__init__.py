@@ -1,15 +1,77 @@
 # Utils package for Tax Advisor API 
 
-import pdfplumber
+import io
+import logging
+import pymupdf
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Tuple, Union
 
-def extract_salary_slip_data(pdf_path: str) -> Dict[str, Any]:
+logger = logging.getLogger(__name__)
+
+# pdfminer (under the pdfplumber fallback) logs heavily at DEBUG/INFO level
+logging.getLogger("pdfminer").setLevel(logging.WARNING)
+
+# Words whose bottoms are this close (in points) are placed on the same line
+LINE_TOLERANCE = 3
+
+# Salary slip patterns, compiled once at import
+_EMP_PATTERNS = {
+    'name': re.compile(r'Name[:\s]+([A-Za-z ]+)'),
+    'designation': re.compile(r'Designation[:\s]+([A-Za-z ]+)'),
+    'department': re.compile(r'Department[:\s]+([A-Za-z ]+)'),
+    'location': re.compile(r'Location[:\s]+([A-Za-z ]+)'),
+    'bank_name': re.compile(r'Bank Name[:\s]+([A-Za-z0-9 ]+)'),
+    'account_no': re.compile(r'Account No[:\s]+([0-9]+)')
+}
+# A line mentioning Earnings (checked first) or Deductions starts that table's section.
+# Row patterns match at line starts across a whole section; [^\S\n] keeps each row on one line.
+_SECTION_PAT = re.compile(r'^.*(?:Earnings|Deductions).*$', re.M)
+_EARNING_LINE_PAT = re.compile(r'^\d+[^\S\n]+([A-Za-z ]+)[^\S\n]+(\d+)', re.M)
+_DEDUCTION_LINE_PAT = re.compile(r'^(\d+)?[^\S\n]*([A-Za-z ]+)[^\S\n]+(\d+)', re.M)
+_GROSS_PAT = re.compile(r'Gross Salary\s+(\d+)')
+_NET_PAT = re.compile(r'Net Salary.*?([\d,]+)')
+_NUMBER_PAT = re.compile(r'([\d,]+)')
+_REIMBURSEMENT_PAT = re.compile(r'Reimbursement\s+(\d+)')
+
+def _page_text(page) -> str:
+    """Rebuild a page's text line by line from word positions, matching pdfplumber's layout"""
+    words = sorted(page.get_text("words"), key=lambda w: (w[3], w[0]))
+    lines = []
+    line = []
+    line_bottom = None
+    for word in words:
+        if line_bottom is None or abs(word[3] - line_bottom) > LINE_TOLERANCE:
+            if line:
+                lines.append(line)
+            line = []
+            line_bottom = word[3]
+        line.append(word)
+    if line:
+        lines.append(line)
+    return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
+
+def _open_pdf(pdf: Union[str, bytes]):
+    """Open a PDF from a path or from its raw bytes (bytes or a bytearray)"""
+    if isinstance(pdf, str):
+        return pymupdf.open(pdf)
+    return pymupdf.open(stream=pdf, filetype="pdf")
+
+def _extract_text(pdf: Union[str, bytes]) -> str:
+    """Extract a PDF's text with PyMuPDF, falling back to pdfplumber if none is found"""
+    with _open_pdf(pdf) as doc:
+        text = "\n".join(_page_text(page) for page in doc)
+    if not text.strip():
+        import pdfplumber
+        with pdfplumber.open(pdf if isinstance(pdf, str) else io.BytesIO(pdf)) as plumber_pdf:
+            text = "\n".join(page.extract_text() or '' for page in plumber_pdf.pages)
+    return text
+
+def extract_salary_slip_data(pdf: Union[str, bytes]) -> Dict[str, Any]:
     """
-    Extracts key fields from a salary slip PDF using pdfplumber.
+    Extracts key fields from a salary slip PDF (a path or its raw bytes) using PyMuPDF.
     Returns a dictionary with employee details, earnings, deductions, gross/net salary, etc.
     """
-    print("DEBUG: extract_salary_slip_data called")  # Guaranteed debug print
+    logger.debug("extract_salary_slip_data called for %s", pdf if isinstance(pdf, str) else f"{len(pdf)} bytes")
     data = {
         'employee': {},
         'earnings': {},
@@ -18,74 +80,62 @@ def extract_salary_slip_data(pdf_path: str) -> Dict[str, Any]:
         'net_salary': None,
         'reimbursement': None
     }
-    with pdfplumber.open(pdf_path) as pdf:
-        text = "\n".join(page.extract_text() or '' for page in pdf.pages)
-        # Extract employee details
-        emp_patterns = {
-            'name': r'Name[:\s]+([A-Za-z ]+)',
-            'designation': r'Designation[:\s]+([A-Za-z ]+)',
-            'department': r'Department[:\s]+([A-Za-z ]+)',
-            'location': r'Location[:\s]+([A-Za-z ]+)',
-            'bank_name': r'Bank Name[:\s]+([A-Za-z0-9 ]+)',
-            'account_no': r'Account No[:\s]+([0-9]+)'
-        }
-        for key, pat in emp_patterns.items():
-            m = re.search(pat, text)
+    text = _extract_text(pdf)
+    # Extract employee details
+    for key, pat in _EMP_PATTERNS.items():
+        m = pat.search(text)
+        if m:
+            data['employee'][key] = m.group(1).strip()
+    # Extract earnings and deductions tables
+    earnings = {}
+    deductions = {}
+    markers = list(_SECTION_PAT.finditer(text))
+    for idx, marker in enumerate(markers):
+        # Each section runs from its marker line to the next one
+        end = markers[idx + 1].start() if idx + 1 < len(markers) else len(text)
+        if 'Earnings' in marker.group():
+            for m in _EARNING_LINE_PAT.finditer(text, marker.end(), end):
+                earnings[m.group(1).strip()] = float(m.group(2))
+        else:
+            logger.debug("Deductions section start")
+            for m in _DEDUCTION_LINE_PAT.finditer(text, marker.end(), end):
+                logger.debug('Deduction row: "%s"', m.group())
+                deductions[m.group(2).strip()] = float(m.group(3))
+    data['earnings'] = earnings
+    data['deductions'] = deductions
+    # Extract gross, net, reimbursement
+    gross = _GROSS_PAT.search(text)
+    if gross:
+        data['gross_salary'] = float(gross.group(1))
+    logger.debug("Extracted text:\n%s", text)
+    lines = text.splitlines()
+    # Robust Net Salary extraction: scan lines for 'Net Salary' and extract the number
+    for idx, line in enumerate(lines):
+        if 'Net Salary' in line:
+            logger.debug('Net salary line: "%s"', line)
+            m = _NET_PAT.search(line)
             if m:
-                data['employee'][key] = m.group(1).strip()
-        # Extract earnings and deductions tables
-        earnings = {}
-        deductions = {}
-        lines = text.splitlines()
-        earnings_section = False
-        deductions_section = False
-        for line in lines:
-            if 'Earnings' in line:
-                earnings_section = True
-                deductions_section = False
-                continue
-            if 'Deductions' in line:
-                deductions_section = True
-                earnings_section = False
-                print('--- Deductions Section Start ---')  # DEBUG
-                continue
-            if earnings_section and line.strip():
-                m = re.match(r'\d+\s+([A-Za-z ]+)\s+(\d+)', line)
-                if m:
-                    earnings[m.group(1).strip()] = float(m.group(2))
-            if deductions_section and line.strip():
-                print(f'DEDUCTION LINE: "{line}"')  # DEBUG
-                m = re.match(r'(\d+)?\s*([A-Za-z ]+)\s+(\d+)', line)
-                if m:
-                    key = m.group(2).strip()
-                    value = float(m.group(3))
-                    deductions[key] = value
-        data['earnings'] = earnings
-        data['deductions'] = deductions
-        # Extract gross, net, reimbursement
-        gross = re.search(r'Gross Salary\s+(\d+)', text)
-        if gross:
-            data['gross_salary'] = float(gross.group(1))
-        # Print every line for debugging
-        for idx, line in enumerate(lines):
-            print(f"LINE {idx}: {line}")
-        # Robust Net Salary extraction: scan lines for 'Net Salary' and extract the number
-        for idx, line in enumerate(lines):
-            if 'Net Salary' in line:
-                print(f'NET SALARY LINE: "{line}"')  # DEBUG
-                m = re.search(r'Net Salary.*?([\d,]+)', line)
-                if m:
-                    data['net_salary'] = float(m.group(1).replace(',', ''))
+                data['net_salary'] = float(m.group(1).replace(',', ''))
+                break
+            # If not found, try the next line
+            elif idx + 1 < len(lines):
+                next_line = lines[idx + 1]
+                logger.debug('Net salary next line: "%s"', next_line)
+                m2 = _NUMBER_PAT.search(next_line)
+                if m2:
+                    data['net_salary'] = float(m2.group(1).replace(',', ''))
                     break
-                # If not found, try the next line
-                elif idx + 1 < len(lines):
-                    next_line = lines[idx + 1]
-                    print(f'NET SALARY NEXT LINE: "{next_line}"')  # DEBUG
-                    m2 = re.search(r'([\d,]+)', next_line)
-                    if m2:
-                        data['net_salary'] = float(m2.group(1).replace(',', ''))
-                        break
-        reimb = re.search(r'Reimbursement\s+(\d+)', text)
-        if reimb:
-            data['reimbursement'] = float(reimb.group(1))
-    return data 
\ No newline at end of file
+    reimb = _REIMBURSEMENT_PAT.search(text)
+    if reimb:
+        data['reimbursement'] = float(reimb.group(1))
+    return data
+
+def extract_and_summarize(pdf: Union[str, bytes]) -> Tuple[Dict[str, Any], float, float]:
+    """
+    Extracts a salary slip and summarizes it for the tax calculation in the same call.
+    Returns (data, gross salary, total deductions).
+    """
+    data = extract_salary_slip_data(pdf)
+    gross = data['gross_salary'] or 0
+    deductions_total = sum(data['deductions'].values())
+    return data, gross, deductions_total
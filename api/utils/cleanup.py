@@ -1,79 +1,180 @@
 import os
-import schedule
+import shutil
+import signal
+import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 from api.database.connection import DatabaseManager
 from api.database.utils import DatabaseUtils
-from api.config.settings import settings
+from api.config.settings import settings, ensure_directory
+
+# Upload files with no documents row, probed through the stored_name index
+ORPHANED_FILES_SQL = """
+    SELECT upload_files.name FROM temp.upload_files
+    WHERE NOT EXISTS (
+        SELECT 1 FROM documents WHERE documents.stored_name = upload_files.name
+    )
+"""
+
+# Seconds between cleanup runs
+CLEANUP_INTERVAL = 3600
+
+# Uploads are written just before their documents row commits, so younger files are left alone
+ORPHAN_MIN_AGE = 600
+
+# Concurrent unlinks hide per-call latency on network filesystems
+UNLINK_WORKERS = 32
+
+def _try_unlink(file_path: str) -> Tuple[str, Optional[Exception]]:
+    """Remove a file, returning the error instead of raising it"""
+    try:
+        os.unlink(file_path)
+        return file_path, None
+    except Exception as e:
+        return file_path, e
 
 class FileCleanupService:
-    def __init__(self):
-        self.db_manager = DatabaseManager()
+    def __init__(self, db_manager: Optional[DatabaseManager] = None, upload_folder: Optional[str] = None):
+        if db_manager is None:
+            db_manager = DatabaseManager()
+            db_manager.setup_database()
+        self.db_manager = db_manager
         self.db_utils = DatabaseUtils(self.db_manager)
+        # The upload folder is created once here; file paths are built by appending to this prefix
+        self._upload_prefix = os.path.join(ensure_directory(upload_folder or settings.UPLOAD_FOLDER), '')
+        # Documents and upload folder state at the last orphan scan
+        self._last_scan_signature = None
+        # (upload folder mtime, file names) from the last listing, reused while the folder is unchanged
+        self._last_listing = None
+    
+    def _list_upload_files(self) -> Tuple[Optional[int], List[str]]:
+        """(upload folder mtime, names of the files in it), listed without holding any database lock"""
+        try:
+            # Stat before listing, so a file added mid-listing still changes the next run's mtime
+            mtime = os.stat(self._upload_prefix).st_mtime_ns
+        except FileNotFoundError:
+            # Removed since the service started; there is nothing to clean up
+            return None, []
+        if self._last_listing is not None and self._last_listing[0] == mtime:
+            return self._last_listing
+        try:
+            # scandir reports the type without a stat per entry
+            with os.scandir(self._upload_prefix) as entries:
+                names = [entry.name for entry in entries if entry.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            return None, []
+        self._last_listing = (mtime, names)
+        return self._last_listing
+    
+    def _scan_signature(self, conn: sqlite3.Connection, mtime: Optional[int]) -> Tuple[int, int, Optional[int]]:
+        """(document count, highest document id, upload folder mtime) to tell if a scan could find anything new"""
+        count, max_id = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM documents").fetchone()
+        return count, max_id, mtime
     
     def cleanup_expired_files(self):
         """Remove files associated with expired sessions"""
         try:
-            # Clean up expired sessions (this also removes related files)
-            expired_count = self.db_utils.cleanup_expired_sessions()
+            # The folder is listed before the write lock is taken; only staging and the anti-join need it
+            mtime, upload_names = self._list_upload_files()
+            
+            # Expire sessions and find the files they leave behind in one write transaction
+            with self.db_manager.get_write_connection() as conn:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    expired_sessions = self.db_utils.delete_expired_sessions(conn)
+                    # Skip the scan when no document or upload has changed since the last one
+                    signature = self._scan_signature(conn, mtime)
+                    if signature == self._last_scan_signature:
+                        unreferenced = []
+                    else:
+                        unreferenced = self._unreferenced(conn, upload_names)
+            
+            # Age checks stat the candidates, so they also wait until the lock is released
+            orphaned_files, deferred = self._settled(unreferenced)
+            
+            # Uploads kept in a per-session directory go with their session, a whole tree at a time
+            for session_id in expired_sessions:
+                shutil.rmtree(f"{self._upload_prefix}{session_id}", ignore_errors=True)
             
-            # Additional cleanup: Remove orphaned files
-            orphaned_files = self.find_orphaned_files()
-            for file_path in orphaned_files:
-                try:
-                    os.remove(file_path)
-                    print(f"Removed orphaned file: {file_path}")
-                except Exception as e:
-                    print(f"Failed to remove orphaned file {file_path}: {e}")
+            # Remove orphaned files once the transaction has committed
+            if orphaned_files:
+                with ThreadPoolExecutor(max_workers=min(UNLINK_WORKERS, len(orphaned_files))) as executor:
+                    results = list(executor.map(_try_unlink, orphaned_files))
+                # Report once the pool has drained so worker output doesn't interleave
+                for file_path, error in results:
+                    if error is None:
+                        print(f"Removed orphaned file: {file_path}")
+                    else:
+                        print(f"Failed to remove orphaned file {file_path}: {error}")
             
-            print(f"Cleanup completed: {expired_count} expired sessions, {len(orphaned_files)} orphaned files")
+            print(f"Cleanup completed: {len(expired_sessions)} expired sessions, {len(orphaned_files)} orphaned files")
+            # Only a run that got this far, leaving no young files for later, has dealt with everything the signature covers
+            self._last_scan_signature = None if deferred else signature
             
         except Exception as e:
             print(f"Cleanup error: {e}")
     
-    def find_orphaned_files(self):
+    def find_orphaned_files(self, conn: Optional[sqlite3.Connection] = None):
         """Find files in upload directory that are not in database"""
-        orphaned = []
-        
-        if not os.path.exists(settings.UPLOAD_FOLDER):
-            return orphaned
-        
-        # Get all files in upload directory
-        upload_files = set()
-        for filename in os.listdir(settings.UPLOAD_FOLDER):
-            file_path = os.path.join(settings.UPLOAD_FOLDER, filename)
-            if os.path.isfile(file_path):
-                upload_files.add(filename)
-        
-        # Get files referenced in database
-        with self.db_manager.get_connection() as conn:
-            cursor = conn.execute("SELECT file_url FROM documents")
-            db_files = set()
-            for row in cursor.fetchall():
-                filename = row['file_url'].split('/')[-1]
-                db_files.add(filename)
-        
-        # Find orphaned files
-        orphaned_filenames = upload_files - db_files
-        
-        for filename in orphaned_filenames:
-            file_path = os.path.join(settings.UPLOAD_FOLDER, filename)
-            orphaned.append(file_path)
-        
-        return orphaned
+        if conn is None:
+            with self.db_manager.get_connection() as conn:
+                return self.find_orphaned_files(conn)
+        _, upload_names = self._list_upload_files()
+        return self._settled(self._unreferenced(conn, upload_names))[0]
+    
+    def _unreferenced(self, conn: sqlite3.Connection, upload_names: List[str]) -> List[str]:
+        """The upload file names no documents row refers to"""
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS upload_files (name TEXT PRIMARY KEY)")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.upload_files (name) VALUES (?)",
+                ((name,) for name in upload_names)
+            )
+            # Find orphaned files with an anti-join against the documents table
+            return [row['name'] for row in conn.execute(ORPHANED_FILES_SQL)]
+        finally:
+            # The staged names are only needed for this query
+            conn.execute("DELETE FROM temp.upload_files")
+    
+    def _settled(self, filenames: List[str]) -> Tuple[List[str], bool]:
+        """Paths of the files old enough to remove, and whether any younger ones were passed over"""
+        # Only the few candidates are stat'ed, to skip files whose documents row may still be on its way
+        cutoff = time.time() - ORPHAN_MIN_AGE
+        orphaned_files = []
+        deferred = False
+        for filename in filenames:
+            file_path = f"{self._upload_prefix}{filename}"
+            try:
+                if os.stat(file_path).st_mtime > cutoff:
+                    deferred = True
+                    continue
+            except FileNotFoundError:
+                continue
+            orphaned_files.append(file_path)
+        return orphaned_files, deferred
 
 def run_cleanup_service():
     """Run the cleanup service"""
     cleanup_service = FileCleanupService()
     
-    # Schedule cleanup every hour
-    schedule.every().hour.do(cleanup_service.cleanup_expired_files)
+    # SIGTERM/SIGINT end the wait immediately instead of at the next run
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
     
     print("File cleanup service started. Running every hour.")
     
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+    # Wait out the time left to a monotonic deadline, so runs stay hourly however long each takes
+    next_run = time.monotonic() + CLEANUP_INTERVAL
+    while not stop.wait(max(0, next_run - time.monotonic())):
+        cleanup_service.cleanup_expired_files()
+        # A run that overshoots its slot is followed straight away, without queueing catch-up runs
+        next_run = max(next_run + CLEANUP_INTERVAL, time.monotonic())
+    
+    print("File cleanup service stopped.")
 
 if __name__ == "__main__":
     run_cleanup_service() 
\ No newline at end of file
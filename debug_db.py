@@ -21,6 +21,7 @@ with db_manager.get_connection() as conn:
 # Test 2: File database
 print("\n2. Testing file database:")
 db_manager2 = DatabaseManager("./test_debug.db")
+db_manager2.setup_database()
 
 with db_manager2.get_connection() as conn:
     cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
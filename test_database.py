@@ -6,6 +6,8 @@ Validates all database components are working correctly
 
 import sys
 import os
+import shutil
+import tempfile
 from datetime import datetime, timedelta
 
 # Add the api directory to the Python path
@@ -15,6 +17,7 @@ from api.database.connection import DatabaseManager
 from api.database.utils import DatabaseUtils
 from api.database.migrations import DatabaseMigration
 from api.config.settings import settings
+from api.utils.cleanup import FileCleanupService
 
 def test_database_connection():
     """Test database connection and table creation"""
@@ -24,17 +27,16 @@ def test_database_connection():
         # Test with a temporary database file
         test_db_path = "./test_database.db"
         db_manager = DatabaseManager(test_db_path)
+        db_manager.setup_database()
         print("✓ Database manager created successfully")
         
-        # Test connection
+        # Test connection and table creation on the same connection
         with db_manager.get_connection() as conn:
             cursor = conn.execute("SELECT 1")
             result = cursor.fetchone()
             assert result[0] == 1
-        print("✓ Database connection working")
-        
-        # Test if tables were created
-        with db_manager.get_connection() as conn:
+            print("✓ Database connection working")
+            
             cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
             tables = [row[0] for row in cursor.fetchall()]
             print(f"✓ Tables created: {tables}")
@@ -131,11 +133,77 @@ def test_database_operations(utils, session_id):
         assert len(session_data['ai_conversations']) == 1
         print("✓ All data retrieved successfully")
         
+        # Test per-table getters and the display bundle
+        assert utils.get_documents(session_id, limit=1)[0]['id'] == doc_id
+        assert utils.get_tax_calculations(session_id)[0]['employee_name'] == "Test Employee"
+        bundle = utils.get_session_bundle(session_id)
+        assert bundle['document']['id'] == doc_id
+        assert bundle['tax_calculation']['id'] == calc_id
+        assert bundle['user_inputs'] == {"salary": {"basic_salary": "500000"}}
+        print("✓ Session bundle retrieved successfully")
+        
+        # Test bulk document save
+        utils.save_documents_bulk(session_id, [
+            (f"bulk_{i}.pdf", f"/uploads/bulk_{i}.pdf", "payslip") for i in range(3)
+        ])
+        assert len(utils.get_documents(session_id)) == 4
+        print("✓ Bulk documents saved successfully")
+        
+        # Same-second uploads come back newest first from both getters
+        assert [doc['id'] for doc in utils.get_session_data(session_id)['documents']] == \
+            [doc['id'] for doc in utils.get_documents(session_id)]
+        print("✓ Session data and document getter agree on order")
+        
         return True
     except Exception as e:
         print(f"✗ Database operations test failed: {e}")
         return False
 
+def test_cleanup_service(db_manager):
+    """Test expired session and orphaned file cleanup"""
+    print("\n🧪 Testing cleanup service...")
+    
+    upload_folder = tempfile.mkdtemp()
+    try:
+        utils = DatabaseUtils(db_manager)
+        cleanup_service = FileCleanupService(db_manager, upload_folder)
+        live_session = utils.create_session()
+        expired_session = utils.create_session(session_duration_hours=-1)
+        
+        # Each session has an uploaded file, and the expired one a per-session directory too
+        for session_id, file_name in [(live_session, "live.pdf"), (expired_session, "expired.pdf")]:
+            utils.save_document(session_id, file_name, f"/uploads/{file_name}", "payslip")
+        os.makedirs(os.path.join(upload_folder, expired_session))
+        for file_name in ["live.pdf", "expired.pdf", "orphan.pdf", "young.pdf", os.path.join(expired_session, "a.pdf")]:
+            with open(os.path.join(upload_folder, file_name), "wb") as f:
+                f.write(b"%PDF")
+        # Age every file but young.pdf past the window in which uploads are still being saved
+        for file_name in ["live.pdf", "expired.pdf", "orphan.pdf"]:
+            os.utime(os.path.join(upload_folder, file_name), (0, 0))
+        
+        cleanup_service.cleanup_expired_files()
+        
+        with db_manager.get_connection() as conn:
+            sessions = {row[0] for row in conn.execute(
+                "SELECT session_id FROM user_sessions WHERE session_id IN (?, ?)", (live_session, expired_session)
+            )}
+            documents = {row[0] for row in conn.execute(
+                "SELECT stored_name FROM documents WHERE session_id IN (?, ?)", (live_session, expired_session)
+            )}
+        assert sessions == {live_session}
+        assert documents == {"live.pdf"}
+        print("✓ Expired session and its documents removed")
+        
+        assert sorted(os.listdir(upload_folder)) == ["live.pdf", "young.pdf"]
+        print("✓ Orphaned files removed, live and recent uploads kept")
+        
+        return True
+    except Exception as e:
+        print(f"✗ Cleanup service test failed: {e}")
+        return False
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
 def test_migration_system():
     """Test migration system"""
     print("\n🧪 Testing migration system...")
@@ -202,6 +270,12 @@ def main():
         print("\n❌ Database operations test failed.")
         return False
     
+    # Test cleanup service
+    cleanup_ok = test_cleanup_service(db_manager)
+    if not cleanup_ok:
+        print("\n❌ Cleanup service test failed.")
+        return False
+    
     # Test migration system
     migration_ok = test_migration_system()
     if not migration_ok:
@@ -220,6 +294,7 @@ def main():
     print("   - All tables created successfully")
     print("   - Session management functional")
     print("   - CRUD operations working")
+    print("   - Expired session and orphaned file cleanup working")
     print("   - Migration system operational")
     print("   - Configuration management working")
     
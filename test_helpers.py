@@ -0,0 +1,47 @@
+"""
+Shared helpers for the phase verification scripts
+Runs tests side by side while keeping each test's printed output together
+"""
+
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+# Each test thread prints into its own buffer, shown once the test finishes
+_captured = threading.local()
+
+class _ThreadStdout:
+    """Stand-in for sys.stdout that writes to the current thread's capture buffer"""
+    def __init__(self, stream):
+        self._stream = stream
+    
+    def write(self, text):
+        return getattr(_captured, 'buffer', self._stream).write(text)
+    
+    def flush(self):
+        getattr(_captured, 'buffer', self._stream).flush()
+
+@contextmanager
+def capture_thread_output():
+    """Route prints from threads running run_captured into their own buffers"""
+    stdout = sys.stdout
+    sys.stdout = _ThreadStdout(stdout)
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+def run_captured(test):
+    """Run one (name, func) test, returning its name, result and printed output"""
+    test_name, test_func = test
+    _captured.buffer = io.StringIO()
+    try:
+        passed = test_func()
+    except Exception as e:
+        print(f"✗ {test_name} test raised: {e}")
+        passed = False
+    finally:
+        output = _captured.buffer.getvalue()
+        del _captured.buffer
+    return test_name, passed, output
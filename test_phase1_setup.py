@@ -4,12 +4,15 @@ Phase 1 Database Setup Verification Script
 Tests all components of the database setup as specified in Phase1_Database_Setup.md
 """
 
+import functools
 import os
 import sys
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import tempfile
+from test_helpers import capture_thread_output, run_captured
 
 # Add the api directory to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'api'))
@@ -22,24 +25,40 @@ from database.utils import DatabaseUtils
 from database.migrations import DatabaseMigration
 from config.settings import settings
 
+# One in-memory database for the connection, schema and operations tests; nothing touches disk
+TEST_DB_PATH = ":memory:"
+
+_test_manager_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _build_test_manager(db_path: str) -> DatabaseManager:
+    db_manager = DatabaseManager(db_path)
+    db_manager.setup_database()
+    return db_manager
+
+def get_test_manager(db_path: str) -> DatabaseManager:
+    """Build a test database and its schema once, shared by every test that uses it"""
+    # lru_cache doesn't stop concurrent tests from each building their own
+    with _test_manager_lock:
+        return _build_test_manager(db_path)
+
 def test_database_connection():
     """Test 1.1: Database Connection Test"""
     print("🔍 Testing Database Connection...")
     
     try:
-        with tempfile.NamedTemporaryFile(suffix='.db') as tmp:
-            db_manager = DatabaseManager(tmp.name)
-            utils = DatabaseUtils(db_manager)
-            session_id = utils.create_session()
-            print(f"✓ Session created: {session_id[:8]}...")
-            valid = utils.validate_session(session_id)
-            if valid:
-                print("✓ Session validation successful")
-            else:
-                print("✗ Session validation failed")
-                return False
-            expired_count = utils.cleanup_expired_sessions()
-            print(f"✓ Cleaned up {expired_count} expired sessions")
+        db_manager = get_test_manager(TEST_DB_PATH)
+        utils = DatabaseUtils(db_manager)
+        session_id = utils.create_session()
+        print(f"✓ Session created: {session_id[:8]}...")
+        valid = utils.validate_session(session_id)
+        if valid:
+            print("✓ Session validation successful")
+        else:
+            print("✗ Session validation failed")
+            return False
+        expired_count = utils.cleanup_expired_sessions()
+        print(f"✓ Cleaned up {expired_count} expired sessions")
         return True
     except Exception as e:
         print(f"✗ Database connection test failed: {e}")
@@ -50,18 +69,21 @@ def test_database_schema():
     print("\n🔍 Testing Database Schema...")
     
     try:
-        with tempfile.NamedTemporaryFile(suffix='.db') as tmp:
-            db_manager = DatabaseManager(tmp.name)
-            with db_manager.get_connection() as conn:
-                tables = ['user_sessions', 'documents', 'user_inputs', 'tax_calculations', 'ai_conversations']
-                for table in tables:
-                    cursor = conn.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-                    result = cursor.fetchone()
-                    if result:
-                        print(f"✓ Table {table} exists")
-                    else:
-                        print(f"✗ Table {table} does not exist")
-                        return False
+        db_manager = get_test_manager(TEST_DB_PATH)
+        with db_manager.get_connection() as conn:
+            tables = ['user_sessions', 'documents', 'user_inputs', 'tax_calculations', 'ai_conversations']
+            # One query finds every expected table that exists
+            cursor = conn.execute(
+                f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({','.join('?' * len(tables))})",
+                tables
+            )
+            present = {row[0] for row in cursor}
+            for table in tables:
+                if table in present:
+                    print(f"✓ Table {table} exists")
+                else:
+                    print(f"✗ Table {table} does not exist")
+                    return False
         return True
     except Exception as e:
         print(f"✗ Schema validation test failed: {e}")
@@ -72,28 +94,28 @@ def test_database_operations():
     print("\n🔍 Testing Database Operations...")
     
     try:
-        with tempfile.NamedTemporaryFile(suffix='.db') as tmp:
-            db_manager = DatabaseManager(tmp.name)
-            utils = DatabaseUtils(db_manager)
-            session_id = utils.create_session()
-            doc_id = utils.save_document(session_id, "test.pdf", "/uploads/test.pdf", "pay_slip")
-            print(f"✓ Document saved with ID: {doc_id}")
-            input_id = utils.save_user_input(session_id, "salary", "basic_salary", "500000")
-            print(f"✓ User input saved with ID: {input_id}")
-            calc_id = utils.save_tax_calculation(session_id, 500000.0, 50000.0, 45000.0, 100000.0, 40000.0, "Test Employee")
-            print(f"✓ Tax calculation saved with ID: {calc_id}")
-            conv_id = utils.save_ai_conversation(session_id, "What is my tax liability?", "Based on your income...")
-            print(f"✓ AI conversation saved with ID: {conv_id}")
-            session_data = utils.get_session_data(session_id)
-            docs = session_data.get('documents', [])
-            user_inputs = session_data.get('user_inputs', [])
-            tax_calcs = session_data.get('tax_calculations', [])
-            ai_convs = session_data.get('ai_conversations', [])
-            assert len(docs) == 1, f"Expected 1 document, got {len(docs)}"
-            assert len(user_inputs) == 1, f"Expected 1 user input, got {len(user_inputs)}"
-            assert len(tax_calcs) == 1, f"Expected 1 tax calculation, got {len(tax_calcs)}"
-            assert len(ai_convs) == 1, f"Expected 1 AI conversation, got {len(ai_convs)}"
-            print("✓ Session data retrieval successful")
+        db_manager = get_test_manager(TEST_DB_PATH)
+        utils = DatabaseUtils(db_manager)
+        session_id = utils.create_session()
+        # (label, save function, arguments, session_data key holding the saved row)
+        cases = [
+            ("Document", utils.save_document,
+             (session_id, "test.pdf", "/uploads/test.pdf", "pay_slip"), 'documents'),
+            ("User input", utils.save_user_input,
+             (session_id, "salary", "basic_salary", "500000"), 'user_inputs'),
+            ("Tax calculation", utils.save_tax_calculation,
+             (session_id, 500000.0, 50000.0, 45000.0, 100000.0, 40000.0, "Test Employee"), 'tax_calculations'),
+            ("AI conversation", utils.save_ai_conversation,
+             (session_id, "What is my tax liability?", "Based on your income..."), 'ai_conversations'),
+        ]
+        for label, save_fn, args, _ in cases:
+            row_id = save_fn(*args)
+            print(f"✓ {label} saved with ID: {row_id}")
+        session_data = utils.get_session_data(session_id)
+        for label, _, _, key in cases:
+            count = len(session_data.get(key, []))
+            assert count == 1, f"Expected 1 {label.lower()}, got {count}"
+        print("✓ Session data retrieval successful")
         return True
     except Exception as e:
         print(f"✗ Database operations test failed: {e}")
@@ -167,9 +189,15 @@ def test_file_structure():
         ".env.local"
     ]
     
+    # One listing of the project root and one walk of api/ instead of a stat per file
+    with os.scandir('.') as entries:
+        existing = {entry.name for entry in entries if entry.is_file()}
+    for dirpath, _, filenames in os.walk('api'):
+        existing.update(f"{dirpath}/{name}".replace(os.sep, '/') for name in filenames)
+    
     missing_files = []
     for file_path in required_files:
-        if not os.path.exists(file_path):
+        if file_path not in existing:
             missing_files.append(file_path)
         else:
             print(f"✓ {file_path} exists")
@@ -198,9 +226,15 @@ def main():
     passed = 0
     total = len(tests)
     
-    for test_name, test_func in tests:
+    # The tests share no state, so run them side by side and report in order
+    with capture_thread_output():
+        with ThreadPoolExecutor(max_workers=len(tests)) as executor:
+            results = list(executor.map(run_captured, tests))
+    
+    for test_name, test_passed, output in results:
         print(f"\n📋 Running {test_name} Test...")
-        if test_func():
+        print(output, end="")
+        if test_passed:
             passed += 1
             print(f"✅ {test_name} Test PASSED")
         else: